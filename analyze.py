@@ -1,80 +1,96 @@
-import json
-import statistics as stat
+from array import array
 import sys
 import os
-from typing import List, Tuple
+from typing import Dict, Iterable, List
 
+import ijson
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
+import numpy as np
+
+# code of simulator.types.TransactionType.GET; older results store the type's name instead
+GET_TYPES = (0, "GET")
+
+def collect(transactions: Iterable[dict]) -> Dict[str, dict]:
+    """Aggregates latencies and read correctness for every GET in a single pass over the transactions."""
+    eager_latencies = array("d")
+    deferred_latencies = array("d")
+    eager_latency_sum = 0.0
+    deferred_latency_sum = 0.0
+    eager_correct = 0
+    deferred_correct = 0
+    reads = 0
+
+    for transaction in transactions:
+        if transaction["type"] not in GET_TYPES:
+            continue
+
+        reads += 1
+
+        latency = transaction["latency"]
+        eager_latencies.append(latency["eager"])
+        deferred_latencies.append(latency["deferred"])
+        eager_latency_sum += latency["eager"]
+        deferred_latency_sum += latency["deferred"]
+
+        read_value = transaction["read_value"]
+        if read_value["reference"] == read_value["eager"]:
+            eager_correct += 1
+        if read_value["reference"] == read_value["deferred"]:
+            deferred_correct += 1
 
-def get_latency_stats(experiments, name: str) -> Tuple[float, float]:
-    latencies = [
-        transaction["latency"][name]
-        for experiment in experiments["results"]
-        for transaction in experiment
-        if transaction["type"] == "GET"
-    ]
-
-    return stat.mean(latencies), stat.median(latencies)
-
-def get_read_ratios(experiments, name: str) -> Tuple[int, int]:
-    correct_reads = 0
-    wrong_reads = 0
-
-    for experiment in experiments["results"]:
-        for transaction in experiment:
-            if transaction["type"] != "GET":
-                continue
-            
-            if transaction["read_value"]["reference"] == transaction["read_value"][name]:
-                correct_reads += 1
-            else:
-                # if name == "deferred":
-                #     print(transaction)
-                wrong_reads += 1
+    return {
+        "eager": {
+            "latency_sum": eager_latency_sum,
+            "latencies": eager_latencies,
+            "correct": eager_correct,
+            "wrong": reads - eager_correct,
+        },
+        "deferred": {
+            "latency_sum": deferred_latency_sum,
+            "latencies": deferred_latencies,
+            "correct": deferred_correct,
+            "wrong": reads - deferred_correct,
+        },
+    }
 
-    total_reads = correct_reads + wrong_reads
 
-    return correct_reads/total_reads, wrong_reads/total_reads
+def summarize(aggregates: dict):
+    latencies = np.frombuffer(aggregates["latencies"], dtype=np.float64)
+    total_reads = aggregates["correct"] + aggregates["wrong"]
 
+    return {
+        "latency": {
+            "average": aggregates["latency_sum"] / len(latencies),
+            "median": float(np.median(latencies)),
+        },
+        "reads": {
+            "correct": aggregates["correct"] / total_reads,
+            "lost_update": aggregates["wrong"] / total_reads,
+        }
+    }
 
-def get_analysis(experiments):
-    eager_lat_avg, eager_lat_med = get_latency_stats(experiments, "eager")
-    eager_correct_pct, eager_wrong_pct = get_read_ratios(experiments, "eager")
 
-    deferred_lat_avg, deferred_lat_med = get_latency_stats(experiments, "deferred")
-    deferred_correct_pct, deferred_wrong_pct = get_read_ratios(experiments, "deferred")
+def get_analysis(parameters: dict, transactions: Iterable[dict]):
+    aggregates = collect(transactions)
 
     return {
-        "parameters": experiments["parameters"],
-        "eager": {
-            "latency": {
-                "average": eager_lat_avg,
-                "median": eager_lat_med,
-            },
-            "reads": {
-                "correct": eager_correct_pct,
-                "lost_update": eager_wrong_pct
-            }
-        },
-        "deferred": {
-            "latency": {
-                "average": deferred_lat_avg,
-                "median": deferred_lat_med,
-            },
-            "reads": {
-                "correct": deferred_correct_pct,
-                "lost_update": deferred_wrong_pct
-            }
-        }
+        "parameters": parameters,
+        "eager": summarize(aggregates["eager"]),
+        "deferred": summarize(aggregates["deferred"]),
     }
 
 
 def get_all_analysis(folder: str):
     all_analysis = []
     for filename in os.listdir(folder):
-        with open(os.path.join(folder, filename), "r") as f:
-            experiments = json.loads(f.read())
-        analysis = get_analysis(experiments)
+        # stream transactions from the file instead of loading the whole results tree
+        with open(os.path.join(folder, filename), "rb") as f:
+            parameters = next(ijson.items(f, "parameters", use_float=True))
+            f.seek(0)
+            transactions = ijson.items(f, "results.item.item", use_float=True)
+            analysis = get_analysis(parameters, transactions)
         all_analysis.append(analysis)
     return all_analysis
 
@@ -86,6 +102,9 @@ def main(args: List[str]):
 
     keyspace_sizes = [a["parameters"]["keyspace_size"] for a in analysis]
 
+    # both plots are drawn on the same figure, clearing the axes in between
+    fig, ax = plt.subplots()
+
     # plot keyspace size x latency
     med_eager_lats = [a["eager"]["latency"]["median"] for a in analysis]
     med_deferred_lats = [a["deferred"]["latency"]["median"] for a in analysis]
@@ -93,30 +112,26 @@ def main(args: List[str]):
     avg_deferred_lats = [a["deferred"]["latency"]["average"] for a in analysis]
     med_extra_lats = [deferred - eager for eager, deferred in zip(med_eager_lats, med_deferred_lats)]
     avg_extra_lats = [deferred - eager for eager, deferred in zip(avg_eager_lats, avg_deferred_lats)]
-    plt.plot(keyspace_sizes, med_extra_lats, label="median deferred - median eager")
-    plt.plot(keyspace_sizes, avg_extra_lats, label="average deferred - average eager")
-    # plt.plot(keyspace_sizes, eager_lats, label="eager")
-    # plt.plot(keyspace_sizes, deferred_lats, label="deferred")
-    plt.xlabel("keyspace size")
-    plt.ylabel("latency (s)")
-    plt.legend()
-    plt.savefig(f"plots/keyspace-latency-{results_folder}.png")
-    plt.clf()
-    plt.cla()
-    plt.close()
+    ax.plot(keyspace_sizes, med_extra_lats, label="median deferred - median eager")
+    ax.plot(keyspace_sizes, avg_extra_lats, label="average deferred - average eager")
+    # ax.plot(keyspace_sizes, eager_lats, label="eager")
+    # ax.plot(keyspace_sizes, deferred_lats, label="deferred")
+    ax.set_xlabel("keyspace size")
+    ax.set_ylabel("latency (s)")
+    ax.legend()
+    fig.savefig(f"plots/keyspace-latency-{results_folder}.png")
+    ax.clear()
 
     # plot keyspace size x lost updates
     eager_wrong_pct = [a["eager"]["reads"]["lost_update"] for a in analysis]
     deferred_wrong_pct = [a["deferred"]["reads"]["lost_update"] for a in analysis]
-    plt.plot(keyspace_sizes, eager_wrong_pct, label="eager")
-    plt.plot(keyspace_sizes, deferred_wrong_pct, label="deferred")
-    plt.xlabel("keyspace size")
-    plt.ylabel("% of lost updates")
-    plt.legend()
-    plt.savefig(f"plots/keyspace-lostupdates-{results_folder}.png")
-    plt.clf()
-    plt.cla()
-    plt.close()
+    ax.plot(keyspace_sizes, eager_wrong_pct, label="eager")
+    ax.plot(keyspace_sizes, deferred_wrong_pct, label="deferred")
+    ax.set_xlabel("keyspace size")
+    ax.set_ylabel("% of lost updates")
+    ax.legend()
+    fig.savefig(f"plots/keyspace-lostupdates-{results_folder}.png")
+    plt.close(fig)
 
 
 if __name__ == "__main__":
@@ -1,13 +1,17 @@
 import argparse
 from collections import deque
-import json
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
 import logging
-from typing import List, Dict, Tuple, Deque, Set
+import math
+from typing import List, Optional, Tuple, Deque, Set
 import sys
 
-from simulator.workload import create_workload
-from simulator.types import Transaction, TransactionType
-from simulator.db import BasePartition, EagerPartition, DeferredPartition, ReferencePartition
+import numpy as np
+import orjson
+
+from simulator.workload import Workload, create_workload
+from simulator.types import Transaction
+from simulator.db import NO_READ, BasePartition, EagerPartition, DeferredPartition, ReferencePartition
 
 logging.basicConfig(level=logging.INFO)
 
@@ -28,22 +32,40 @@ def parse_args(args: List[str]) -> argparse.Namespace:
 
     return parser.parse_args(args)
 
-def run_on_partitions(duration: float, keyspace_size: int, workload: List[Transaction], partitions: List[BasePartition]) -> Tuple[Dict[int, int], Dict[Transaction, float]]:
-    transaction_queue: Deque[Transaction] = deque(workload)
-
-    partition_keyspace_size = keyspace_size // len(partitions)
+def _next_tick(tick: int, event_time: float) -> int:
+    """First tick after `tick` whose time is not earlier than `event_time`."""
+    if math.isinf(event_time):
+        return tick + 1
+    # the division can land a hair above a whole tick. rounding down within that error may pick a tick that is
+    # slightly early, which is just a no-op clock, instead of skipping the tick the event is due on
+    return max(tick + 1, math.ceil(event_time / TIME_STEP - 1e-9))
+
+def run_on_partitions(duration: float, workload: Workload, partitions: List[BasePartition]) -> Tuple[np.ndarray, np.ndarray]:
+    # every partition gets its own arrival queue, so submitting doesn't route transactions on each tick
+    transaction_queues: List[Deque[Transaction]] = [
+        deque(transactions) for transactions in workload.partition_transactions(len(partitions))
+    ]
 
+    # time advances in TIME_STEP ticks, but ticks where no partition has anything to do are skipped
+    tick = 0
     time = 0
     while time < duration:
         for p in partitions:
             p.clock(time)
 
-        while len(transaction_queue) > 0 and transaction_queue[0].submit_time <= time:
-            transaction = transaction_queue.popleft()
-            partition = partitions[transaction.key // partition_keyspace_size]
-            partition.submit_transaction(transaction)
+        for p, transaction_queue in zip(partitions, transaction_queues):
+            while len(transaction_queue) > 0 and transaction_queue[0].submit_time <= time:
+                p.submit_transaction(transaction_queue.popleft())
 
-        time += TIME_STEP
+        next_time = min(
+            [p.next_event_time() for p in partitions]
+            + [queue[0].submit_time for queue in transaction_queues if len(queue) > 0]
+        )
+        if math.isinf(next_time):
+            break
+
+        tick = _next_tick(tick, next_time)
+        time = tick * TIME_STEP
 
     unfinished_partitions: Set[BasePartition] = set(
         p for p in partitions if not p.is_finished
@@ -51,93 +73,127 @@ def run_on_partitions(duration: float, keyspace_size: int, workload: List[Transa
 
     # wait for all partitions to finish
     while len(unfinished_partitions) > 0:
-        finished_partitions = set()
-        for p in unfinished_partitions:
+        for p in list(unfinished_partitions):
             p.clock(time)
             if p.is_finished:
-                finished_partitions.add(p)
-        unfinished_partitions = unfinished_partitions.difference(finished_partitions)
-        time += TIME_STEP
+                unfinished_partitions.discard(p)
 
-    logger.debug("FINISHED")
-    for p in partitions:
-        logger.debug(f"partition 0 -> {len(p._pending)} pending, {len(p._started)} started, {len(p._finished_at)} finished")
-    logger.debug("-------------------------")
+        next_time = min((p.next_event_time() for p in unfinished_partitions), default=math.inf)
+        tick = _next_tick(tick, next_time)
+        time = tick * TIME_STEP
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("FINISHED")
+        for p in partitions:
+            logger.debug("partition %d -> %d pending, %d started, %d finished", p.id, len(p._pending), len(p._started), p._num_finished)
+        logger.debug("-------------------------")
 
-    read_values: Dict[Transaction, int] = {}
-    latencies: Dict[Transaction, float] = {}
+    # every transaction ran on exactly one partition, so merge what each of them recorded
+    read_values = np.full(len(workload), NO_READ, dtype=np.int64)
+    latencies = np.full(len(workload), np.nan)
     for p in partitions:
-        for transaction, latency in p.get_latencies().items():
-            latencies[transaction] = latency
+        partition_latencies = p.get_latencies(workload.submit_time)
+        finished = ~np.isnan(partition_latencies)
+        latencies[finished] = partition_latencies[finished]
 
-        for transaction, read_value in p.get_read_values().items():
-            read_values[transaction] = read_value
+        partition_read_values = p.get_read_values()
+        read = partition_read_values != NO_READ
+        read_values[read] = partition_read_values[read]
 
     return read_values, latencies
 
 def run(
+    executor: Executor,
     num_partitions: int,
     duration: float,
     keyspace_size: int,
     max_defer_time: float,
     **kwargs
-):
+) -> Tuple[Workload, Future, Future, Future]:
+    """Generates a workload and submits its reference, eager and deferred simulations to the executor."""
     workload = create_workload(
         keyspace_size=keyspace_size,
         **kwargs
     )
 
     reference: List[BasePartition] = [
-        ReferencePartition(id=i) for i in range(num_partitions)
+        ReferencePartition(id=i, num_transactions=len(workload)) for i in range(num_partitions)
     ]
 
     eager: List[BasePartition] = [
-        EagerPartition(id=i) for i in range(num_partitions)
+        EagerPartition(id=i, num_transactions=len(workload)) for i in range(num_partitions)
     ]
 
     deferred: List[BasePartition] = [
-        DeferredPartition(id=i, max_defer_time=max_defer_time) for i in range(num_partitions)
+        DeferredPartition(id=i, num_transactions=len(workload), time_step=TIME_STEP, max_defer_time=max_defer_time) for i in range(num_partitions)
     ]
 
-    reference_reads, _ = run_on_partitions(duration, keyspace_size, workload, reference)
-    eager_reads, eager_latencies = run_on_partitions(duration, keyspace_size, workload, eager)
-    deferred_reads, deferred_latencies = run_on_partitions(duration, keyspace_size, workload, deferred)
+    # the simulations share nothing but the workload, so they can run in separate processes
+    return (
+        workload,
+        executor.submit(run_on_partitions, duration, workload, reference),
+        executor.submit(run_on_partitions, duration, workload, eager),
+        executor.submit(run_on_partitions, duration, workload, deferred),
+    )
 
-    return workload, reference_reads, eager_reads, deferred_reads, eager_latencies, deferred_latencies
+def _read_values_list(read_values: np.ndarray) -> List[Optional[int]]:
+    return [None if value == NO_READ else value for value in read_values.tolist()]
 
 def main(args_list: List[str]):
     args = parse_args(args_list)
 
     results = []
 
-    for _ in range(args.num_experiments):
-        workload, reference_reads, eager_reads, deferred_reads, eager_lat, deferred_lat = run(
-            max_defer_time=args.max_defer_time,
-            num_partitions=args.num_partitions,
-            tps_average=args.tps, 
-            keyspace_size=args.keyspace_size, 
-            duration=args.duration, 
-            execution_average=args.execution_time_avg,
-        )
+    with ProcessPoolExecutor() as executor:
+        # submit every experiment before waiting on any, so all of them share the pool
+        experiments = [
+            run(
+                executor,
+                max_defer_time=args.max_defer_time,
+                num_partitions=args.num_partitions,
+                tps_average=args.tps, 
+                keyspace_size=args.keyspace_size, 
+                duration=args.duration, 
+                execution_average=args.execution_time_avg,
+            )
+            for _ in range(args.num_experiments)
+        ]
+
+        experiments = [
+            (workload, reference.result(), eager.result(), deferred.result())
+            for workload, reference, eager, deferred in experiments
+        ]
+
+    for workload, (reference_reads, _), (eager_reads, eager_lat), (deferred_reads, deferred_lat) in experiments:
+        reference_reads = _read_values_list(reference_reads)
+        eager_reads = _read_values_list(eager_reads)
+        deferred_reads = _read_values_list(deferred_reads)
+        eager_lat = eager_lat.tolist()
+        deferred_lat = deferred_lat.tolist()
 
         experiment_results = [
             {
-                "id": t.id,
-                "type": t.type.name,
-                "key": t.key,
-                "submit_time": t.submit_time,
-                "execution_time": t.execution_time,
+                "id": id,
+                "type": type_code,
+                "key": key,
+                "submit_time": submit_time,
+                "execution_time": execution_time,
                 "read_value": {
-                    "reference": reference_reads.get(t),
-                    "eager": eager_reads.get(t),
-                    "deferred": deferred_reads.get(t)
+                    "reference": reference_reads[id],
+                    "eager": eager_reads[id],
+                    "deferred": deferred_reads[id]
                 },
                 "latency": {
-                    "eager": eager_lat[t],
-                    "deferred": deferred_lat[t]
+                    "eager": eager_lat[id],
+                    "deferred": deferred_lat[id]
                 }
             }
-            for t in workload
+            for id, (type_code, key, submit_time, execution_time) in enumerate(zip(
+                workload.type_code.tolist(),
+                workload.key.tolist(),
+                workload.submit_time.tolist(),
+                workload.execution_time.tolist(),
+            ))
         ]
         results.append(experiment_results)
 
@@ -153,8 +209,8 @@ def main(args_list: List[str]):
         "results": results,
     }
 
-    with open(args.out_file, "w") as f:
-        f.write(json.dumps(experiment, indent=4))
+    with open(args.out_file, "wb") as f:
+        f.write(orjson.dumps(experiment, option=orjson.OPT_INDENT_2))
 
 
 if __name__ == "__main__":
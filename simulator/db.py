@@ -1,57 +1,71 @@
 from abc import ABC, abstractmethod
+from array import array
 from collections import defaultdict, deque
+import heapq
 import logging
+import math
 from typing import List, Tuple, Dict, Set, Deque
 
+import numpy as np
+
 from simulator.types import Transaction, TransactionType
 
 logger = logging.getLogger("partition")
 
+# read value of transactions that are not GETs or that ran on another partition
+NO_READ = -1
+
 class BasePartition(ABC):
-    def __init__(self, id: int) -> None:
+    def __init__(self, id: int, num_transactions: int) -> None:
         self.id = id
 
-        # keep track of processing times
-        self._submitted_at: Dict[Transaction, float] = {}
-        self._started_at: Dict[Transaction, float] = {}
-        self._finished_at: Dict[Transaction, float] = {}
+        # keep track of processing times, indexed by transaction id. NaN until it happens
+        self._submitted_at = array("d", [math.nan]) * num_transactions
+        self._finished_at = array("d", [math.nan]) * num_transactions
+        self._num_submitted = 0
+        self._num_finished = 0
 
         self.keys: Dict[int, int] = defaultdict(int)
         self._current_time = 0
 
-        self._pending: Set[Transaction] = set()
+        # submitted since the last clock, in submission order
+        self._pending: List[Transaction] = []
         self._started: Set[Transaction] = set()
 
+        # started transactions ordered by when they should finish, with the id as a tiebreaker
+        self._finish_heap: List[Tuple[float, int, Transaction]] = []
+
         # track the state of keys when transactions were created
-        self._keystate: Dict[Transaction, int] = {}
+        self._keystate = array("q", [0]) * num_transactions
 
         # track the values that GET transactions read
-        self._read_values: Dict[Transaction, int] = {}
+        self._read_values = array("q", [NO_READ]) * num_transactions
 
         self._logger = logger.getChild(str(id))
 
     def _transaction_start(self, transaction: Transaction) -> None:
         """Saves the state of a transaction's key, effectively making a snapshot of the database for it when this is called."""
-        self._keystate[transaction] = self.keys[transaction.key]
+        self._keystate[transaction.id] = self.keys[transaction.key]
         self._started.add(transaction)
-        self._started_at[transaction] = self._current_time
+        heapq.heappush(self._finish_heap, (self._current_time + transaction.execution_time, transaction.id, transaction))
 
-        self._logger.debug(f"{self._current_time:.4f}: {transaction.id} started. read {transaction.key}->{self.keys[transaction.key]}")
+        self._logger.debug("%.4f: %d started. read %d->%d", self._current_time, transaction.id, transaction.key, self.keys[transaction.key])
 
     def _transaction_finish(self, transaction: Transaction) -> None:
         self._started.remove(transaction)
-        self._finished_at[transaction] = self._current_time
+        self._finished_at[transaction.id] = self._current_time
+        self._num_finished += 1
 
         if transaction.type == TransactionType.GET:
-            self._keystate[transaction] = self.keys[transaction.key]
+            self._read_values[transaction.id] = self.keys[transaction.key]
             return
 
         if transaction.type == TransactionType.OVERWRITE:
             self.keys[transaction.key] = 0
         else:
-            self.keys[transaction.key] = self._keystate[transaction] + 1
+            self.keys[transaction.key] = self._keystate[transaction.id] + 1
 
-        self._logger.debug(f"{self._current_time:.4f}: {transaction.id} finished. wrote {transaction.key}->{self.keys[transaction.key]} ({transaction.type})")
+        self._logger.debug("%.4f: %d finished. wrote %d->%d (%s)", self._current_time, transaction.id, transaction.key, self.keys[transaction.key], transaction.type.name)
 
     @abstractmethod
     def _start_transactions(self, transaction: Transaction) -> None:
@@ -59,40 +73,45 @@ class BasePartition(ABC):
 
     @property
     def is_finished(self):
-        return len(self._submitted_at) == len(self._finished_at)
+        return self._num_submitted == self._num_finished
 
-    def get_latency_for_transaction(self, transaction: Transaction) -> None:
-        return self._finished_at[transaction] - transaction.submit_time
+    def get_read_values(self) -> np.ndarray:
+        """Values read by each transaction, indexed by id. NO_READ for transactions this partition didn't read for."""
+        return np.frombuffer(self._read_values, dtype=np.int64)
 
-    def get_read_value_for_transaction(self, transaction: Transaction) -> int:
-        assert transaction in self._finished_at
-        return self._keystate[transaction]
-
-    def get_read_values(self) -> Dict[Transaction, int]:
-        values = {}
-        for transaction in self._finished_at:
-            if transaction.type == TransactionType.GET:
-                values[transaction] = self.get_read_value_for_transaction(transaction)
-        return values
-
-    def get_latencies(self) -> Dict[Transaction, float]:
-        return {
-            transaction: self.get_latency_for_transaction(transaction)
-            for transaction in self._finished_at
-        }
+    def get_latencies(self, submit_time: np.ndarray) -> np.ndarray:
+        """Latency of each transaction, indexed by id. NaN for transactions this partition didn't finish."""
+        return np.frombuffer(self._finished_at, dtype=np.float64) - submit_time
 
     def clock(self, current_time: float) -> None:
         self._current_time = current_time
+
+        # nothing in flight, so the tick is a no-op
+        if self.is_finished:
+            return
+
         self._start_transactions()
-        
-        # calculate which transactions should have finished based on execution time
-        finished_transactions = set(t for t in self._started if self._current_time - self._started_at[t] >= t.execution_time)
-        for transaction in finished_transactions:
+
+        # finish transactions whose execution time has elapsed
+        while len(self._finish_heap) > 0 and self._finish_heap[0][0] <= self._current_time:
+            _, _, transaction = heapq.heappop(self._finish_heap)
             self._transaction_finish(transaction)
 
+    def next_event_time(self) -> float:
+        """Earliest time at which clocking this partition may change its state, or infinity if it is idle."""
+        # pending transactions are picked up on the next clock
+        if len(self._pending) > 0:
+            return self._current_time
+
+        if len(self._finish_heap) > 0:
+            return self._finish_heap[0][0]
+
+        return math.inf
+
     def submit_transaction(self, transaction: Transaction) -> None:
-        self._pending.add(transaction)
-        self._submitted_at[transaction] = self._current_time
+        self._pending.append(transaction)
+        self._submitted_at[transaction.id] = self._current_time
+        self._num_submitted += 1
 
 
 class ReferencePartition(BasePartition):
@@ -102,10 +121,18 @@ class ReferencePartition(BasePartition):
         self._current_time = current_time
 
     def submit_transaction(self, transaction: Transaction) -> None:
-        self._submitted_at[transaction] = transaction
+        self._submitted_at[transaction.id] = self._current_time
+        self._num_submitted += 1
         self._transaction_start(transaction)
         self._transaction_finish(transaction)
 
+    def _transaction_start(self, transaction: Transaction) -> None:
+        # transactions finish as soon as they start, so they never go on the finish heap
+        self._keystate[transaction.id] = self.keys[transaction.key]
+        self._started.add(transaction)
+
+        self._logger.debug("%.4f: %d started. read %d->%d", self._current_time, transaction.id, transaction.key, self.keys[transaction.key])
+
     def _start_transactions(self, transaction: Transaction) -> None:
         pass
 
@@ -113,9 +140,8 @@ class ReferencePartition(BasePartition):
 class EagerPartition(BasePartition):
     """Partition implementation that executes transactions eagerly without checking for current pending transactions."""
     def _start_transactions(self) -> None:
-        pending_clone = set(self._pending)
-        for transaction in pending_clone:
-            self._pending.remove(transaction)
+        pending, self._pending = self._pending, []
+        for transaction in pending:
             self._transaction_start(transaction)
 
 
@@ -123,88 +149,142 @@ class DeferredPartition(BasePartition):
     """Partition implementation that defers transactions."""
     def __init__(self, 
         id: int, 
+        num_transactions: int,
+        time_step: float,
         max_defer_time: float = -1,
     ) -> None:
-        super().__init__(id)
+        super().__init__(id, num_transactions)
 
         self.max_defer_time = max_defer_time
 
-        self._deferred_at: Dict[Transaction, Set[Transaction]] = {}
+        # deadlines are compared in whole ticks, so float error in the clock can't move them by a tick
+        self._time_step = time_step
+        self._max_defer_ticks = round(max_defer_time / time_step)
+        self._deferred_tick = array("q", [0]) * num_transactions
 
-        self._depended_by: Dict[Transaction, Set[Transaction]] = defaultdict(set)
-        self._depends_on: Dict[Transaction, Set[Transaction]] = defaultdict(set)
+        # deferred transactions and the ids of the transactions they still wait on, keyed by id
+        self._deferred: Dict[int, Transaction] = {}
+        self._depends_on: Dict[int, Set[int]] = {}
+        self._depended_by: Dict[int, Set[int]] = defaultdict(set)
+
+        # deferred transactions whose dependencies are all gone, started on the next clock
+        self._ready: List[int] = []
+
+        # deferred transactions in the order they were deferred, to be triggered once max_defer_time passes
+        self._defer_deadlines: Deque[int] = deque()
+
+        # writes bucketed by key, so finding what a transaction depends on doesn't scan the whole partition
+        self._pending_by_key: Dict[int, Set[Transaction]] = defaultdict(set)
+        self._deferred_by_key: Dict[int, Set[Transaction]] = defaultdict(set)
+        self._started_by_key: Dict[int, Set[Transaction]] = defaultdict(set)
+
+    def _current_tick(self) -> int:
+        return round(self._current_time / self._time_step)
 
     def _transaction_defer(self, transaction: Transaction) -> bool:
-        depends_on_pending = set(
-            other for other in self._pending
-            if other.key == transaction.key
-            and self._submitted_at[other] < self._submitted_at[transaction]
-            and other.type != TransactionType.GET
-        )
-        depends_on_deferred = set(
-            other for other in self._depends_on
-            if other.key == transaction.key
-            and other.type != TransactionType.GET
-        )
-        depends_on_started = set(
-            other for other in self._started 
-            if other.key == transaction.key
-            and other.type != TransactionType.GET
-        )
-        depends_on = (
-            depends_on_pending
-                .union(depends_on_deferred)
-                .union(depends_on_started)
+        submitted_at = self._submitted_at[transaction.id]
+        depends_on = set(
+            other for other in self._pending_by_key[transaction.key]
+            if self._submitted_at[other.id] < submitted_at
         )
+        depends_on.update(self._deferred_by_key[transaction.key])
+        depends_on.update(self._started_by_key[transaction.key])
 
         if len(depends_on) == 0:
             return False
 
-        self._deferred_at[transaction] = self._current_time
+        self._deferred_tick[transaction.id] = self._current_tick()
+
+        if self._logger.isEnabledFor(logging.DEBUG):
+            depends_on_text = ", ".join(str(other.id) for other in depends_on)
+            self._logger.debug("deferring %d because it depends on %s", transaction.id, depends_on_text)
+        self._deferred[transaction.id] = transaction
+        self._depends_on[transaction.id] = set(other.id for other in depends_on)
+        for other in depends_on:
+            self._depended_by[other.id].add(transaction.id)
+
+        if transaction.type != TransactionType.GET:
+            self._deferred_by_key[transaction.key].add(transaction)
+
+        if self.max_defer_time > 0:
+            self._defer_deadlines.append(transaction.id)
 
-        depends_on_text = ", ".join(str(other.id) for other in depends_on)
-        self._logger.debug(f"deferring {transaction.id} because it depends on {depends_on_text}")
-        self._depends_on[transaction] = depends_on
-        for t in depends_on:
-            self._depended_by[t].add(transaction)
-        
         return True
 
+    def _transaction_trigger_eager(self, transaction: Transaction) -> None:
+        """Stops other transactions from waiting on one that has been deferred for too long, to avoid latency."""
+        self._logger.debug("%.4f: %d triggered eagerly", self._current_time, transaction.id)
+        self._release_dependents(transaction.id)
+
+        # transactions deferred from now on don't wait on it either
+        if transaction.type != TransactionType.GET:
+            self._deferred_by_key[transaction.key].discard(transaction)
+
+    def _release_dependents(self, id: int) -> None:
+        for depended_by in self._depended_by.pop(id, ()):
+            dependencies = self._depends_on[depended_by]
+            dependencies.remove(id)
+            if len(dependencies) == 0:
+                self._ready.append(depended_by)
+
     def _start_transactions(self) -> None:
         # check new transactions
-        pending_clone = set(self._pending)
-        for transaction in pending_clone:
-            self._pending.remove(transaction)
+        pending, self._pending = self._pending, []
+        for transaction in pending:
+            self._pending_by_key[transaction.key].discard(transaction)
             if not self._transaction_defer(transaction):
                 self._transaction_start(transaction)
 
-        # check if deferred transactions can now run
-        started: Set[Transaction] = set()
-        for transaction, dependencies in self._depends_on.items():
-            # whether to trigger transaction eagerly even though it still has dependencies to avoid latency
-            trigger_eager = (
-                self.max_defer_time > 0
-                and self._current_time - self._deferred_at[transaction] > self.max_defer_time
-            )
+        # trigger transactions deferred for max_defer_time. deadlines are in deferral order
+        current_tick = self._current_tick()
+        while (
+            len(self._defer_deadlines) > 0
+            and current_tick - self._deferred_tick[self._defer_deadlines[0]] >= self._max_defer_ticks
+        ):
+            id = self._defer_deadlines.popleft()
+            if id in self._deferred:
+                self._transaction_trigger_eager(self._deferred[id])
 
-            # remove dependencies from future transactions since we're executing this eagerly
-            if trigger_eager:
-                for depended_by in self._depended_by[transaction]:
-                    self._depends_on[depended_by].remove(transaction)
+        # start deferred transactions that no longer depend on anything
+        ready, self._ready = self._ready, []
+        for id in ready:
+            del self._depends_on[id]
+            self._transaction_start(self._deferred.pop(id))
 
-                del self._depended_by[transaction]
+        # drop deadlines of transactions that already started, so the earliest one is still relevant
+        while len(self._defer_deadlines) > 0 and self._defer_deadlines[0] not in self._deferred:
+            self._defer_deadlines.popleft()
 
-            if len(dependencies) == 0:
-                started.add(transaction)
-                self._transaction_start(transaction)
+    def next_event_time(self) -> float:
+        if len(self._ready) > 0:
+            return self._current_time
 
-        for started_transaction in started:
-            del self._depends_on[started_transaction]
-                
+        next_time = super().next_event_time()
+
+        # deadline for triggering the longest deferred transaction eagerly
+        if len(self._defer_deadlines) > 0:
+            deadline_tick = self._deferred_tick[self._defer_deadlines[0]] + self._max_defer_ticks
+            next_time = min(next_time, deadline_tick * self._time_step)
+
+        return next_time
+
+    def submit_transaction(self, transaction: Transaction) -> None:
+        super().submit_transaction(transaction)
+
+        if transaction.type != TransactionType.GET:
+            self._pending_by_key[transaction.key].add(transaction)
+
+    def _transaction_start(self, transaction: Transaction) -> None:
+        super()._transaction_start(transaction)
+
+        if transaction.type != TransactionType.GET:
+            self._deferred_by_key[transaction.key].discard(transaction)
+            self._started_by_key[transaction.key].add(transaction)
 
     def _transaction_finish(self, transaction: Transaction) -> None:
         super()._transaction_finish(transaction)
-        
-        for depended_by in self._depended_by[transaction]:
-            self._depends_on[depended_by].remove(transaction)
-        del self._depended_by[transaction]
+
+        if transaction.type != TransactionType.GET:
+            self._started_by_key[transaction.key].discard(transaction)
+
+        self._release_dependents(transaction.id)
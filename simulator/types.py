@@ -1,19 +1,32 @@
 from dataclasses import dataclass
-from enum import Enum
+from enum import IntEnum
 
 
-class TransactionType(str, Enum):
-    GET = "GET"
-    OVERWRITE = "OVERWRITE"
-    INCREASE = "INCREASE"
+class TransactionType(IntEnum):
+    GET = 0
+    OVERWRITE = 1
+    INCREASE = 2
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, eq=False)
 class Transaction:
+    __slots__ = ("id", "type", "submit_time", "execution_time", "key")
+
     id: int
     type: TransactionType
     submit_time: float
     execution_time: float
     key: int
 
+    # ids are unique within a workload, so they alone identify a transaction
+    def __hash__(self) -> int:
+        return self.id
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Transaction) and self.id == other.id
+
+    # frozen slotted instances can't be restored through setattr, so pickle them by their fields
+    def __reduce__(self):
+        return (Transaction, (self.id, self.type, self.submit_time, self.execution_time, self.key))
+
 
@@ -1,3 +1,4 @@
+from dataclasses import dataclass
 import math
 from typing import List, Optional
 
@@ -6,6 +7,51 @@ import numpy as np
 from simulator.types import Transaction, TransactionType
 
 
+# lookup table from type code to TransactionType, faster than calling TransactionType(code)
+TRANSACTION_TYPES = tuple(TransactionType)
+
+
+@dataclass(frozen=True)
+class Workload:
+    """Transactions stored as parallel arrays, ordered by submit time. A transaction's id is its index."""
+    submit_time: np.ndarray
+    execution_time: np.ndarray
+    key: np.ndarray
+    type_code: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.submit_time)
+
+    def transactions(self) -> List[Transaction]:
+        return [
+            Transaction(id=id, type=TRANSACTION_TYPES[type_code], submit_time=submit_time, execution_time=execution_time, key=key)
+            for id, (type_code, submit_time, execution_time, key) in enumerate(zip(
+                self.type_code.tolist(),
+                self.submit_time.tolist(),
+                self.execution_time.tolist(),
+                self.key.tolist(),
+            ))
+        ]
+
+    def partition_transactions(self, num_partitions: int) -> List[List[Transaction]]:
+        """Transactions grouped by the partition that owns their key, each group in submit order."""
+        # keys are spread over partitions by their remainder, which is a bitmask when the count is a power of two
+        if num_partitions & (num_partitions - 1) == 0:
+            partition_ids = self.key & (num_partitions - 1)
+        else:
+            partition_ids = self.key % num_partitions
+
+        # a stable sort keeps every partition's transactions in submit order
+        order = np.argsort(partition_ids, kind="stable")
+        bounds = np.cumsum(np.bincount(partition_ids, minlength=num_partitions))[:-1]
+
+        transactions = self.transactions()
+        return [
+            [transactions[id] for id in ids.tolist()]
+            for ids in np.split(order, bounds)
+        ]
+
+
 def create_workload(
     seed: Optional[int] = None,
     duration: int = 20,
@@ -17,7 +63,7 @@ def create_workload(
     execution_average: float = 1.0,
     execution_deviation: float = 1.0,
     keyspace_size: int = 10
-) -> List[Transaction]:
+) -> Workload:
     """Generate a transaction workload."""
 
     if not math.isclose(get_percentage + overwrite_percentage + increase_percentage, 1.0):
@@ -25,43 +71,31 @@ def create_workload(
 
     rng = np.random.default_rng(seed)
 
-    transactions: List[Transaction] = []
-
-    current_id = 0
-
-    for second in range(duration):
-        second_transactions = int(rng.normal(tps_average, tps_deviation))
-        if second_transactions <= 0:
-            continue
-
-        submit_times = second + rng.random(second_transactions)
-        submit_times.sort()
-        
-        for i in range(second_transactions):
-            submit_time = submit_times[i]
-            execution_time = max(0, rng.normal(execution_average, execution_deviation))
-            chance = rng.random()
-
-            if chance < get_percentage:
-                transaction_type = TransactionType.GET
-            elif chance < get_percentage + overwrite_percentage:
-                transaction_type = TransactionType.OVERWRITE
-            else:
-                transaction_type = TransactionType.INCREASE
-
-            transaction = Transaction(
-                id=current_id,
-                type=transaction_type,
-                submit_time=float(submit_time),
-                execution_time=float(execution_time),
-                key=int(rng.integers(0, keyspace_size))
-            )
-
-            transactions.append(transaction)
-
-            current_id += 1
-
-    transactions.sort(key=lambda t: t.submit_time)
-
-    return transactions
-    
\ No newline at end of file
+    second_transactions = rng.normal(tps_average, tps_deviation, size=duration).astype(np.int64)
+    second_transactions = second_transactions.clip(min=0)
+    total = int(second_transactions.sum())
+
+    # every submit time stays within its second, so one global sort orders them
+    seconds = np.repeat(np.arange(duration), second_transactions)
+    submit_times = np.sort(seconds + rng.random(total))
+    execution_times = np.maximum(0, rng.normal(execution_average, execution_deviation, size=total))
+
+    chances = rng.random(total)
+    type_codes = np.where(
+        chances < get_percentage,
+        TransactionType.GET,
+        np.where(
+            chances < get_percentage + overwrite_percentage,
+            TransactionType.OVERWRITE,
+            TransactionType.INCREASE,
+        ),
+    ).astype(np.int8)
+
+    keys = rng.integers(0, keyspace_size, size=total)
+
+    return Workload(
+        submit_time=submit_times,
+        execution_time=execution_times,
+        key=keys,
+        type_code=type_codes,
+    )